@@ -1,50 +1,67 @@
+import contextlib
+import csv
 import email
+import functools
+import itertools
+import io
+import logging
 import os
-import pandas as pd
-import openpyxl
+from python_calamine import CalamineWorkbook
 import re
 import platform
 from pathlib import Path
+from excel_csv_format import find_column_formats, format_row, header_names
 from datetime import datetime
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
+from concurrent.futures import ProcessPoolExecutor
+from email.parser import BytesParser
+
+logger = logging.getLogger(__name__)
+
+# Date range in the report title: dd/MM/yyyy - dd/MM/yyyy
+_DATE_RE = re.compile(r'(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})')
+
+@functools.lru_cache(maxsize=256)
+def _parse_ddmmyyyy(date_str):
+    """
+    Parse a dd/MM/yyyy date; batches share the same report periods, so results are cached
+    """
+    return datetime.strptime(date_str, '%d/%m/%Y')
 
 def get_unique_filename(file_path):
     """
-    Generate a unique filename by adding _n suffix if file already exists
+    Generate a unique filename by adding _n suffix if file already exists.
+    The file is created empty to reserve the name, so concurrent workers can't pick the same one.
     """
     path = Path(file_path)
-    if not path.exists():
-        return str(path)
-    
     base_name = path.stem
     extension = path.suffix
     parent = path.parent
-    counter = 1
     
+    candidate = path
+    counter = 0
     while True:
-        new_name = f"{base_name}_{counter}{extension}"
-        new_path = parent / new_name
-        if not new_path.exists():
-            return str(new_path)
-        counter += 1
+        try:
+            fd = os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            counter += 1
+            candidate = parent / f"{base_name}_{counter}{extension}"
+            continue
+        os.close(fd)
+        return str(candidate)
 
-def extract_excel_from_eml(eml_file_path, output_dir="temp_attachments"):
+def extract_excel_from_eml(eml_file_path):
     """
-    Extract Excel attachments from an EML file (cross-platform compatible)
+    Extract Excel attachments from an EML file, yielding (filename, data) tuples.
+    Attachments are kept in memory and decoded one at a time as the caller iterates.
     """
-    # Use pathlib for cross-platform path handling
-    output_path = Path(output_dir)
-    output_path.mkdir(exist_ok=True)
-    
-    print(f"  Extracting attachments to: {output_path}")
-    
+    # Parse straight from the file handle rather than reading it all into memory first
     with open(eml_file_path, 'rb') as f:
-        msg = email.message_from_bytes(f.read())
-    
-    excel_files = []
+        msg = BytesParser().parse(f)
     
     for part in msg.walk():
+        # Containers, message bodies and inline images are never Excel attachments
+        if part.get_content_maintype() in ('multipart', 'text', 'image'):
+            continue
         if part.get_content_disposition() == 'attachment':
             filename = part.get_filename()
             if filename:
@@ -56,125 +73,132 @@ def extract_excel_from_eml(eml_file_path, output_dir="temp_attachments"):
                     else:
                         filename = decoded_header[0]
                 
-                if filename.endswith('.xlsx') or filename.endswith('.xls'):
-                    # Use pathlib for cross-platform path handling
-                    file_path = output_path / filename
-                    with open(file_path, 'wb') as f:
-                        f.write(part.get_payload(decode=True))
-                    excel_files.append(str(file_path))
-                    print(f"  Extracted Excel file: {filename}")
-    
-    return excel_files
+                if filename.lower().endswith(('.xlsx', '.xls', '.xlsm', '.xlsb')):
+                    print(f"  Found Excel attachment: {filename}")
+                    yield filename, part.get_payload(decode=True)
 
-def process_sales_excel(excel_file_path):
+def process_sales_excel(excel_file, csv_output_dir):
     """
-    Process the sales Excel file according to the specific rules (cross-platform compatible)
+    Process the sales Excel file according to the specific rules (cross-platform compatible).
+    excel_file may be a path or a binary file object such as io.BytesIO.
+    Calamine loads the sheet, then rows are streamed from it into the CSV file, so the
+    Python side keeps no full copy of the rows. Returns the CSV path and the number of
+    data rows written.
     """
-    excel_path = Path(excel_file_path)
-    
-    # Load workbook to extract dates from row 1
-    wb = openpyxl.load_workbook(str(excel_path))
-    ws = wb.active
-    
-    # Extract dates from row 1
-    title_cell = ws.cell(row=1, column=1).value
-    print(f"  Title cell content: {title_cell}")
-    
-    # Extract dates using regex pattern dd/MM/yyyy
-    date_pattern = r'(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})'
-    date_match = re.search(date_pattern, str(title_cell))
-    
-    if not date_match:
-        raise ValueError("Could not find date range in the expected format dd/MM/yyyy - dd/MM/yyyy")
-    
-    start_date_str = date_match.group(1)
-    end_date_str = date_match.group(2)
-    
-    print(f"  Found dates: {start_date_str} to {end_date_str}")
-    
-    # Parse dates
-    start_date = datetime.strptime(start_date_str, '%d/%m/%Y')
-    end_date = datetime.strptime(end_date_str, '%d/%m/%Y')
-    
-    # Read the Excel file starting from row 3 (which becomes the header)
-    df = pd.read_excel(str(excel_path), header=2)  # 0-indexed, so row 3 becomes header
-    
-    print(f"  Original dataframe shape: {df.shape}")
-    
-    # Insert two new columns at the beginning
-    df.insert(0, 'Period_Start', start_date_str)
-    df.insert(1, 'Period_End', end_date_str)
-    
-    # Generate filename with date format
-    start_formatted = start_date.strftime('%Y%m%d')
-    end_formatted = end_date.strftime('%Y%m%d')
-    output_filename = f"sales_{start_formatted}_{end_formatted}.csv"
+    wb = CalamineWorkbook.from_object(excel_file)
+    try:
+        sheet = wb.get_sheet_by_index(0)
+        rows = sheet.iter_rows()
+        
+        # Extract dates from row 1
+        title_row = next(rows, None)
+        if title_row is None:
+            raise ValueError("Sheet is empty: expected the report title in row 1")
+        title_cell = title_row[0]
+        logger.debug("Title cell content: %s", title_cell)
+        
+        # Extract dates using the precompiled dd/MM/yyyy pattern
+        date_match = _DATE_RE.search(str(title_cell))
+        
+        if not date_match:
+            raise ValueError("Could not find date range in the expected format dd/MM/yyyy - dd/MM/yyyy")
+        
+        start_date_str = date_match.group(1)
+        end_date_str = date_match.group(2)
+        
+        logger.debug("Found dates: %s to %s", start_date_str, end_date_str)
+        
+        # Parse dates
+        start_date = _parse_ddmmyyyy(start_date_str)
+        end_date = _parse_ddmmyyyy(end_date_str)
+        
+        # Skip row 2 (company info); row 3 holds the column headers
+        next(rows, None)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("Sheet has fewer than 3 rows: expected the column headers in row 3")
+        
+        # Pre-pass over the data rows (row 4+) to match pandas' column types in the output
+        column_formats = find_column_formats(itertools.islice(sheet.iter_rows(), 3, None))
+        
+        # Generate filename with date format
+        start_formatted = start_date.strftime('%Y%m%d')
+        end_formatted = end_date.strftime('%Y%m%d')
+        output_filename = f"sales_{start_formatted}_{end_formatted}.csv"
+        
+        # Get unique filename if file already exists
+        csv_path = get_unique_filename(str(Path(csv_output_dir) / output_filename))
+        
+        # Write the two period columns in front of every data row
+        row_count = 0
+        try:
+            with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                writer.writerow(['Period_Start', 'Period_End', *header_names(header)])
+                for row in rows:
+                    writer.writerow([start_date_str, end_date_str, *format_row(row, column_formats)])
+                    row_count += 1
+        except Exception:
+            # Don't leave an empty or truncated CSV behind
+            os.unlink(csv_path)
+            raise
+    finally:
+        wb.close()
     
-    return df, output_filename
+    return csv_path, row_count
 
-def process_eml_file(eml_file_path, csv_output_dir, temp_dir="temp_processing"):
+def process_eml_file(eml_file_path, csv_output_dir):
     """
     Process a single EML file: extract Excel, process it, and save as CSV
     """
     eml_path = Path(eml_file_path)
     csv_dir = Path(csv_output_dir)
-    temp_path = Path(temp_dir)
     
     print(f"\nProcessing: {eml_path.name}")
     
-    # Create temporary directory for this file
-    file_temp_dir = temp_path / eml_path.stem
-    file_temp_dir.mkdir(parents=True, exist_ok=True)
-    
     try:
-        # Extract Excel attachments
-        excel_files = extract_excel_from_eml(str(eml_path), str(file_temp_dir))
-        
-        if not excel_files:
-            print(f"  ❌ No Excel attachments found in {eml_path.name}")
-            return False
-        
+        found_excel = False
         processed_files = []
         
-        # Process each Excel file
-        for excel_file in excel_files:
+        # Process each Excel attachment straight from memory
+        for filename, data in extract_excel_from_eml(str(eml_path)):
+            found_excel = True
             try:
-                print(f"  Processing Excel: {Path(excel_file).name}")
-                
-                # Process the Excel file
-                df, csv_filename = process_sales_excel(excel_file)
-                
-                # Create output path in csv directory
-                csv_output_path = csv_dir / csv_filename
+                print(f"  Processing Excel: {filename}")
                 
-                # Get unique filename if file already exists
-                unique_csv_path = get_unique_filename(str(csv_output_path))
+                # Process the Excel file and save it as CSV
+                csv_path, row_count = process_sales_excel(io.BytesIO(data), str(csv_dir))
                 
-                # Save to CSV
-                df.to_csv(unique_csv_path, index=False)
+                print(f"  ✅ Saved: {Path(csv_path).name}")
+                print(f"  📊 Rows: {row_count}")
                 
-                print(f"  ✅ Saved: {Path(unique_csv_path).name}")
-                print(f"  📊 Shape: {df.shape}")
-                
-                processed_files.append(unique_csv_path)
+                processed_files.append(csv_path)
                 
             except Exception as e:
-                print(f"  ❌ Error processing {Path(excel_file).name}: {str(e)}")
+                print(f"  ❌ Error processing {filename}: {str(e)}")
+            
+            # Release the decoded attachment before the next one is decoded
+            del data
+        
+        if not found_excel:
+            print(f"  ❌ No Excel attachments found in {eml_path.name}")
+            return False
         
         return len(processed_files) > 0
         
     except Exception as e:
         print(f"  ❌ Error processing {eml_path.name}: {str(e)}")
         return False
-    
-    finally:
-        # Clean up temporary files
-        try:
-            import shutil
-            if file_temp_dir.exists():
-                shutil.rmtree(file_temp_dir)
-        except Exception as e:
-            print(f"  ⚠️ Warning: Could not clean up temp directory: {e}")
+
+def process_eml_file_buffered(eml_file_path, csv_output_dir):
+    """
+    Run process_eml_file with its output captured, so parallel workers don't interleave
+    their progress messages. Returns (success, output).
+    """
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer):
+        success = process_eml_file(eml_file_path, csv_output_dir)
+    return success, buffer.getvalue()
 
 def main():
     """
@@ -186,7 +210,6 @@ def main():
     # Define directories
     eml_dir = Path("eml")
     csv_dir = Path("csv")
-    temp_dir = Path("temp_processing")
     
     # Check if directories exist
     if not eml_dir.exists():
@@ -197,8 +220,10 @@ def main():
     csv_dir.mkdir(exist_ok=True)
     print(f"📤 Output directory: {csv_dir.absolute()}")
     
-    # Find all EML files
-    eml_files = list(eml_dir.glob("*.eml"))
+    # Find all EML files (scandir reuses the directory entry type instead of a stat per file)
+    with os.scandir(eml_dir) as entries:
+        eml_files = [Path(entry.path) for entry in entries
+                     if entry.name.endswith('.eml') and entry.is_file(follow_symlinks=False)]
     
     if not eml_files:
         print(f"❌ No EML files found in {eml_dir}")
@@ -208,23 +233,20 @@ def main():
     for eml_file in eml_files:
         print(f"   - {eml_file.name}")
     
-    # Process each EML file
+    # Process EML files in parallel; each one is independent
+    # The default worker count follows the CPU count, capped as Windows requires
+    worker = functools.partial(process_eml_file_buffered, csv_output_dir=str(csv_dir))
     successful = 0
     failed = 0
     
-    for eml_file in eml_files:
-        if process_eml_file(str(eml_file), str(csv_dir), str(temp_dir)):
-            successful += 1
-        else:
-            failed += 1
-    
-    # Clean up main temp directory
-    try:
-        import shutil
-        if temp_dir.exists():
-            shutil.rmtree(temp_dir)
-    except Exception as e:
-        print(f"⚠️ Warning: Could not clean up main temp directory: {e}")
+    with ProcessPoolExecutor() as executor:
+        # Print each file's output as one block, in the order the files were listed
+        for success, output in executor.map(worker, [str(f) for f in eml_files]):
+            print(output, end="")
+            if success:
+                successful += 1
+            else:
+                failed += 1
     
     # Summary
     print(f"\n📋 Processing Summary:")
@@ -233,10 +255,12 @@ def main():
     print(f"   📁 Output directory: {csv_dir.absolute()}")
     
     if successful > 0:
-        csv_files = list(csv_dir.glob("*.csv"))
+        with os.scandir(csv_dir) as entries:
+            csv_files = [entry.name for entry in entries
+                         if entry.name.endswith('.csv') and entry.is_file(follow_symlinks=False)]
         print(f"   📄 Generated CSV files: {len(csv_files)}")
         for csv_file in csv_files:
-            print(f"      - {csv_file.name}")
+            print(f"      - {csv_file}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
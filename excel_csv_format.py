@@ -0,0 +1,121 @@
+"""
+Format calamine cell values the way pd.read_excel followed by DataFrame.to_csv wrote them.
+Shared by the batch, sales and Excel-to-CSV scripts.
+
+Known differences from pandas: text cells that look like numbers (e.g. "007") are written
+as they appear, where pandas converted them to numbers, and duration cells are written as
+Python timedeltas ("1:00:00") rather than pandas Timedeltas ("0 days 01:00:00").
+"""
+from datetime import date, datetime, time
+
+# Cell text that pd.read_excel treated as missing (pandas' default na_values)
+_NA_VALUES = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+def find_column_formats(rows):
+    """
+    Work out how pd.read_excel typed each data column, where that shows in the CSV output:
+    - 'float' for numeric or boolean columns with a blank cell, or numeric columns with a
+      fractional value
+    - 'int' for numeric columns without, where booleans were read as 1/0
+    - 'date' for date columns with no time of day
+    - 'datetime_ms' / 'datetime_us' for date columns with sub-second times, which pandas
+      wrote with a fixed number of fractional digits
+    Returns {column index: format}.
+    """
+    kinds = {}
+    has_blank_or_fraction = set()
+    has_time = set()
+    microseconds = {}
+    for row in rows:
+        for i, value in enumerate(row):
+            if value in _NA_VALUES:
+                has_blank_or_fraction.add(i)
+                continue
+            if isinstance(value, bool):
+                kind = 'bool'
+            elif isinstance(value, (int, float)):
+                kind = 'number'
+                if isinstance(value, float) and not value.is_integer():
+                    has_blank_or_fraction.add(i)
+            elif isinstance(value, date):
+                kind = 'date'
+                if isinstance(value, datetime) and value.time() != time():
+                    has_time.add(i)
+                    if value.microsecond:
+                        microseconds.setdefault(i, set()).add(value.microsecond)
+            else:
+                kind = None
+            previous = kinds.setdefault(i, kind)
+            if previous != kind:
+                # Booleans mixed with numbers were read as numbers; any other mix as plain objects
+                kinds[i] = 'number' if {previous, kind} == {'bool', 'number'} else None
+    
+    formats = {}
+    for i, kind in kinds.items():
+        if kind in ('number', 'bool') and i in has_blank_or_fraction:
+            formats[i] = 'float'
+        elif kind == 'number':
+            formats[i] = 'int'
+        elif kind == 'date' and i not in has_time:
+            formats[i] = 'date'
+        elif kind == 'date' and i in microseconds:
+            whole_ms = all(us % 1000 == 0 for us in microseconds[i])
+            formats[i] = 'datetime_ms' if whole_ms else 'datetime_us'
+    return formats
+
+def format_cell(value, column_format=None):
+    """
+    Format a calamine cell value the way DataFrame.to_csv wrote it after pd.read_excel
+    """
+    if value == '':
+        return value
+    if column_format == 'float':
+        return float(value)
+    if column_format == 'int':
+        return int(value)
+    if column_format == 'date':
+        return value.strftime('%Y-%m-%d')
+    # Calamine returns a plain date when there is no time of day; pandas wrote a full timestamp
+    if isinstance(value, date) and not isinstance(value, datetime):
+        value = datetime.combine(value, time())
+    if column_format == 'datetime_ms':
+        return value.strftime('%Y-%m-%d %H:%M:%S.') + f"{value.microsecond // 1000:03d}"
+    if column_format == 'datetime_us':
+        return value.strftime('%Y-%m-%d %H:%M:%S.%f')
+    # Whole-number floats outside float columns were read as ints
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def format_row(row, column_formats):
+    """
+    Format every cell of a data row, see format_cell; missing values are written empty
+    """
+    return ['' if value in _NA_VALUES else format_cell(value, column_formats.get(i))
+            for i, value in enumerate(row)]
+
+def header_names(row):
+    """
+    Name the header columns as pd.read_excel did: blank cells become "Unnamed: n" and
+    repeated names get a .1, .2, ... suffix, skipping suffixes that another header
+    already uses. Named columns are deduplicated before unnamed ones.
+    """
+    names = [f"Unnamed: {i}" if value == '' else format_cell(value) for i, value in enumerate(row)]
+    unnamed = [i for i, value in enumerate(row) if value == '']
+    counts = {}
+    for i in [i for i in range(len(names)) if i not in unnamed] + unnamed:
+        name = original = names[i]
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[original] = count + 1
+            name = f"{original}.{count}"
+            if name in names:
+                count += 1
+            else:
+                count = counts.get(name, 0)
+        names[i] = name
+        counts[name] = count + 1
+    return names
@@ -1,11 +1,12 @@
+import csv
 import email
+import itertools
 import os
-import pandas as pd
-import base64
+from python_calamine import CalamineWorkbook
 import platform
 from pathlib import Path
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
+from excel_csv_format import find_column_formats, format_row, header_names
+from email.parser import BytesParser
 
 def extract_excel_from_eml(eml_file_path, output_dir="extracted_attachments"):
     """
@@ -17,12 +18,16 @@ def extract_excel_from_eml(eml_file_path, output_dir="extracted_attachments"):
     
     print(f"Running on {platform.system()} - Output directory: {output_path.absolute()}")
     
+    # Parse straight from the file handle rather than reading it all into memory first
     with open(eml_file_path, 'rb') as f:
-        msg = email.message_from_bytes(f.read())
+        msg = BytesParser().parse(f)
     
     excel_files = []
     
     for part in msg.walk():
+        # Containers, message bodies and inline images are never Excel attachments
+        if part.get_content_maintype() in ('multipart', 'text', 'image'):
+            continue
         if part.get_content_disposition() == 'attachment':
             filename = part.get_filename()
             if filename:
@@ -34,11 +39,13 @@ def extract_excel_from_eml(eml_file_path, output_dir="extracted_attachments"):
                     else:
                         filename = decoded_header[0]
                 
-                if filename.endswith('.xlsx') or filename.endswith('.xls'):
+                if filename.lower().endswith(('.xlsx', '.xls', '.xlsm', '.xlsb')):
                     # Use pathlib for cross-platform path handling
                     file_path = output_path / filename
-                    with open(file_path, 'wb') as f:
-                        f.write(part.get_payload(decode=True))
+                    data = part.get_payload(decode=True)
+                    file_path.write_bytes(data)
+                    # Release the decoded payload before the next part is decoded
+                    del data
                     excel_files.append(str(file_path))
                     print(f"Extracted Excel file: {filename} -> {file_path}")
     
@@ -53,11 +60,24 @@ def excel_to_csv(excel_file_path, csv_output_path=None):
         excel_path = Path(excel_file_path)
         csv_output_path = excel_path.stem + ".csv"
     
-    # Read the Excel file (first sheet by default)
-    df = pd.read_excel(excel_file_path)
-    
-    # Save as CSV
-    df.to_csv(csv_output_path, index=False)
+    # Stream the first sheet straight into the CSV file; row 1 holds the headers
+    wb = CalamineWorkbook.from_path(str(excel_file_path))
+    try:
+        sheet = wb.get_sheet_by_index(0)
+        rows = sheet.iter_rows()
+        header = next(rows, None)
+        
+        # Pre-pass over the data rows to match pandas' column types in the output
+        column_formats = find_column_formats(itertools.islice(sheet.iter_rows(), 1, None))
+        
+        with open(csv_output_path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, lineterminator=os.linesep)
+            if header is not None:
+                writer.writerow(header_names(header))
+            for row in rows:
+                writer.writerow(format_row(row, column_formats))
+    finally:
+        wb.close()
     print(f"Saved CSV file: {csv_output_path}")
     
     return csv_output_path
@@ -1,10 +1,26 @@
-import pandas as pd
-import openpyxl
+import csv
+import functools
+import itertools
+import logging
+from python_calamine import CalamineWorkbook
 import re
 from datetime import datetime
 import os
 import platform
 from pathlib import Path
+from excel_csv_format import find_column_formats, format_row, header_names
+
+logger = logging.getLogger(__name__)
+
+# Date range in the report title: dd/MM/yyyy - dd/MM/yyyy
+_DATE_RE = re.compile(r'(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})')
+
+@functools.lru_cache(maxsize=256)
+def _parse_ddmmyyyy(date_str):
+    """
+    Parse a dd/MM/yyyy date; batches share the same report periods, so results are cached
+    """
+    return datetime.strptime(date_str, '%d/%m/%Y')
 
 def process_sales_excel(excel_file_path):
     """
@@ -13,61 +29,78 @@ def process_sales_excel(excel_file_path):
     - Row 2: Company info (ignore) 
     - Row 3: Column headers
     - Row 4+: Data rows
+    Rows are streamed from the sheet straight into the CSV file.
     """
     
-    print(f"Processing on {platform.system()} platform")
+    logger.debug("Processing on %s platform", platform.system())
     excel_path = Path(excel_file_path)
-    print(f"Excel file path: {excel_path.absolute()}")
-    
-    # Load workbook to extract dates from row 1
-    wb = openpyxl.load_workbook(str(excel_path))
-    ws = wb.active
-    
-    # Extract dates from row 1
-    title_cell = ws.cell(row=1, column=1).value
-    print(f"Title cell content: {title_cell}")
-    
-    # Extract dates using regex pattern dd/MM/yyyy
-    date_pattern = r'(\d{2}/\d{2}/\d{4})\s*-\s*(\d{2}/\d{2}/\d{4})'
-    date_match = re.search(date_pattern, str(title_cell))
-    
-    if not date_match:
-        raise ValueError("Could not find date range in the expected format dd/MM/yyyy - dd/MM/yyyy")
-    
-    start_date_str = date_match.group(1)
-    end_date_str = date_match.group(2)
+    logger.debug("Excel file path: %s", excel_path.absolute())
     
-    print(f"Found dates: {start_date_str} to {end_date_str}")
-    
-    # Parse dates
-    start_date = datetime.strptime(start_date_str, '%d/%m/%Y')
-    end_date = datetime.strptime(end_date_str, '%d/%m/%Y')
-    
-    # Read the Excel file starting from row 3 (which becomes the header)
-    df = pd.read_excel(str(excel_path), header=2)  # 0-indexed, so row 3 becomes header
-    
-    print(f"Original dataframe shape: {df.shape}")
-    print(f"Column names: {list(df.columns)}")
-    
-    # Insert two new columns at the beginning
-    df.insert(0, 'Period_Start', start_date_str)
-    df.insert(1, 'Period_End', end_date_str)
-    
-    # Generate output filename using pathlib for cross-platform compatibility
-    start_formatted = start_date.strftime('%Y%m%d')
-    end_formatted = end_date.strftime('%Y%m%d')
-    output_filename = f"sales_{start_formatted}_{end_formatted}.csv"
-    output_path = Path(output_filename)
-    
-    print(f"Output will be saved to: {output_path.absolute()}")
-    
-    # Save to CSV using pathlib
-    df.to_csv(str(output_path), index=False)
-    
-    print(f"Processed file saved as: {output_filename}")
-    print(f"Final dataframe shape: {df.shape}")
-    print(f"First few rows:")
-    print(df.head())
+    wb = CalamineWorkbook.from_path(str(excel_path))
+    try:
+        sheet = wb.get_sheet_by_index(0)
+        rows = sheet.iter_rows()
+        
+        # Extract dates from row 1
+        title_row = next(rows, None)
+        if title_row is None:
+            raise ValueError("Sheet is empty: expected the report title in row 1")
+        title_cell = title_row[0]
+        logger.debug("Title cell content: %s", title_cell)
+        
+        # Extract dates using the precompiled dd/MM/yyyy pattern
+        date_match = _DATE_RE.search(str(title_cell))
+        
+        if not date_match:
+            raise ValueError("Could not find date range in the expected format dd/MM/yyyy - dd/MM/yyyy")
+        
+        start_date_str = date_match.group(1)
+        end_date_str = date_match.group(2)
+        
+        logger.debug("Found dates: %s to %s", start_date_str, end_date_str)
+        
+        # Parse dates
+        start_date = _parse_ddmmyyyy(start_date_str)
+        end_date = _parse_ddmmyyyy(end_date_str)
+        
+        # Skip row 2 (company info); row 3 holds the column headers
+        next(rows, None)
+        header = next(rows, None)
+        if header is None:
+            raise ValueError("Sheet has fewer than 3 rows: expected the column headers in row 3")
+        
+        # Pre-pass over the data rows (row 4+) to match pandas' column types in the output
+        column_formats = find_column_formats(itertools.islice(sheet.iter_rows(), 3, None))
+        logger.debug("Column names: %s", header)
+        
+        # Generate output filename using pathlib for cross-platform compatibility
+        start_formatted = start_date.strftime('%Y%m%d')
+        end_formatted = end_date.strftime('%Y%m%d')
+        output_filename = f"sales_{start_formatted}_{end_formatted}.csv"
+        output_path = Path(output_filename)
+        
+        logger.debug("Output will be saved to: %s", output_path.absolute())
+        
+        # Write the two period columns in front of every data row
+        row_count = 0
+        # Opened outside the try: if open() fails, a file from an earlier run must not be removed
+        f = open(output_path, 'w', newline='', encoding='utf-8')
+        try:
+            with f:
+                writer = csv.writer(f, lineterminator=os.linesep)
+                writer.writerow(['Period_Start', 'Period_End', *header_names(header)])
+                for row in rows:
+                    writer.writerow([start_date_str, end_date_str, *format_row(row, column_formats)])
+                    row_count += 1
+        except Exception:
+            # Don't leave an empty or truncated CSV behind
+            os.unlink(output_path)
+            raise
+    finally:
+        wb.close()
+    
+    logger.debug("Processed file saved as: %s", output_filename)
+    logger.debug("Rows written: %d", row_count)
     
     return output_filename
 